@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: MIT
 
+import dataclasses
 import os.path
 from typing import Optional, Sequence
 
@@ -13,6 +14,8 @@ class ToolConfig(object):
         self.device = None
         self.path = path
         self.led_presets = {}
+        # DeviceInfo for previously seen devices, keyed by serial port.
+        self.device_cache = {}
         if path is not None:
             self.path = os.path.expanduser(path)
             if os.path.exists(self.path):
@@ -32,6 +35,11 @@ class ToolConfig(object):
                 preset.append({'pins': int(setting.pins), 'color': setting.color})
             conf['led_presets'][name] = preset
 
+        if self.device_cache:
+            conf['device_cache'] = {}
+            for port, info in self.device_cache.items():
+                conf['device_cache'][port] = dataclasses.asdict(info)
+
         with open(self.path, "w") as fp:
             tomlkit.dump(conf, fp)
 
@@ -51,3 +59,12 @@ class ToolConfig(object):
                     self.led_presets[key] = []
                     for pattern in entry:
                         self.led_presets[key].append(LedConfig(LedPin(int(pattern['pins'])), pattern['color']))
+
+            if 'device_cache' in conf:
+                for port, entry in conf['device_cache'].items():
+                    self.device_cache[port] = DeviceInfo(
+                        name=str(entry['name']), device_id=str(entry['device_id']),
+                        firmware_version=str(entry['firmware_version']),
+                        manufacturer=str(entry['manufacturer']),
+                        hostname=str(entry['hostname']),
+                        capacity=int(entry['capacity']))
@@ -1,6 +1,15 @@
 # SPDX-License-Identifier: MIT
 
-from typing import Sequence, Optional, List, Iterator
+import contextlib
+import io
+import os
+import re
+import select
+import sys
+import threading
+import time
+import weakref
+from typing import BinaryIO, Dict, Sequence, Optional, List, Iterator, Tuple, Type
 
 import serial
 from absl import logging
@@ -11,15 +20,141 @@ from .types import *
 __all__ = ['Device', 'list_devices']
 
 
-def generate_chunks(n: int) -> Iterator[int]:
-    chunk_size = 1_000
+# Multiple of both the full-speed (64 bytes) and high-speed (512 bytes) USB bulk endpoint sizes, so that chunks map onto
+# whole USB packets.
+TRANSFER_CHUNK_SIZE = 4 * 1024
+
+# Seconds to wait for a Device's reader thread to stop when closing it.
+READER_STOP_TIMEOUT = 1.0
+
+# Serial driver buffer sizes requested on platforms that support it (pyserial defaults to 4 KiB on Windows).
+SERIAL_BUFFER_SIZE = 1 << 20
+
+EVENT_PREFIX = b'+evn'
+ERROR_PREFIX = b'ERROR'
+OK_RESPONSE = b'OK'
+# +PL:<filename>,<size> and +FL:<filename>,<type>,<size> lines in AT+GPL and AT+GFL responses. Filenames may
+# contain commas, so the name group is greedy and the other fields are matched from the end of the line.
+picture_list_re = re.compile(rb'\+PL:(.+),(\d+)')
+file_list_re = re.compile(rb'\+FL:(.+),([^,]+),(\d+)')
+# First byte of OK and ERROR responses, so that lines can be dispatched on `line[0]`.
+OK_BYTE = ord('O')
+ERROR_BYTE = ord('E')
+
+# Sent by the device after the contents of a file transfer.
+TRANSFER_TERMINATOR = b'\r\nOK\r\n'
+
+# Maps the code in `ERROR:<code>` responses to the exception raised for it.
+ERROR_CODES: Dict[bytes, Tuple[Type[Exception], str]] = {
+    b'0': (Exception, 'Unknown error'),
+    b'1': (ValueError, 'Invalid command'),
+    b'2': (ValueError, 'Invalid argument'),
+    b'3': (FileNotFoundError, 'File not found'),
+    b'4': (ValueError, 'Invalid size'),
+}
+
+
+def generate_chunks(n: int, chunk_size: int = TRANSFER_CHUNK_SIZE) -> Iterator[int]:
     bytes_chunked = 0
-    while bytes_chunked + chunk_size < n:
-        yield chunk_size
-        bytes_chunked += chunk_size
+    while bytes_chunked < n:
+        size = min(chunk_size, n - bytes_chunked)
+        yield size
+        bytes_chunked += size
+
+
+def read_line(conn: serial.Serial, buffer: bytearray) -> Optional[bytes]:
+    """Reads a \\r\\n-terminated line from a serial connection.
+
+    serial.Serial.readline() reads one byte at a time; instead, this reads everything that is already waiting (or
+    blocks on a single byte when nothing is), and keeps any bytes past the end of the line in `buffer`.
+
+    :param conn: Connection to read from.
+    :param buffer: Bytes read but not yet consumed. Must be reused across calls for the same connection.
+    :return: The line, without the line terminator, or None if the connection timed out before a full line was read.
+    """
+    while (result := pop_line(buffer)) is None:
+        data = conn.read(conn.in_waiting or 1)
+        if not data:
+            return None
+        buffer += data
+    return result
+
+
+def pop_line(buffer: bytearray) -> Optional[bytes]:
+    """Removes the first \\r\\n-terminated line from `buffer`, returning it without the terminator.
+
+    :return: The line, or None if `buffer` doesn't contain a full line.
+    """
+    idx = buffer.find(b'\r\n')
+    if idx < 0:
+        return None
+    result = bytes(buffer[:idx])
+    del buffer[:idx + 2]
+    return result
+
+
+class ReceiveBuffer(object):
+    """Bytes received from a device but not yet consumed, shared between a Device and its reader thread.
+
+    All fields are guarded by `ready`, which is notified whenever data arrives or the reader thread stops.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ready = threading.Condition()
+        # Exception that made the reader thread stop, if any.
+        self.error: Optional[Exception] = None
+        # Set to ask the reader thread to stop.
+        self.stopping = False
 
-    if n % chunk_size != 0:
-        yield n % chunk_size
+
+def read_loop(conn: serial.Serial, fd: Optional[int], rx: ReceiveBuffer):
+    """Body of a Device's reader thread: moves everything received from `conn` into `rx`.
+
+    Takes the connection and buffer rather than the Device itself, so that the thread doesn't keep the Device alive.
+    """
+    while not rx.stopping:
+        try:
+            waiting = conn.in_waiting
+            if waiting and fd is not None:
+                data = os.read(fd, waiting)
+            else:
+                # Let pyserial block until there's something to read.
+                data = conn.read(waiting or 1)
+        except Exception as e:
+            with rx.ready:
+                if not rx.stopping:
+                    logging.debug('Reader thread stopping: %s', e)
+                    rx.error = e
+                rx.ready.notify_all()
+            return
+        if data:
+            with rx.ready:
+                rx.data += data
+                rx.ready.notify_all()
+
+
+def stop_reader(conn: serial.Serial, rx: ReceiveBuffer, reader: threading.Thread, close_connection: bool):
+    """Stops a Device's reader thread, closing the connection if the Device opened it.
+
+    Connections without cancel_read() that the Device doesn't own can't be interrupted, so in that case the thread is
+    not waited for; it exits after its current read returns.
+    """
+    with rx.ready:
+        rx.stopping = True
+        rx.ready.notify_all()
+    cancel_read = getattr(conn, 'cancel_read', None)
+    if cancel_read is not None:
+        cancel_read()
+    if close_connection:
+        conn.close()
+    if (cancel_read is not None or close_connection) and reader is not threading.current_thread():
+        # cancel_read() only interrupts a read that's already in progress on some platforms (e.g. Windows), so don't
+        # wait forever if the thread was between reads.
+        reader.join(READER_STOP_TIMEOUT)
+        if reader.is_alive():
+            logging.warning('Reader thread %s did not stop; it will exit after its current read returns',
+                            reader.name)
 
 
 def list_devices(baudrate: int) -> List[str]:
@@ -43,10 +178,11 @@ def list_devices(baudrate: int) -> List[str]:
                                timeout=1.0) as conn:
                 logging.debug(f'Connected to {port.device}')
                 conn.write(b'AT+GDN\r\n')
+                rxbuf = bytearray()
                 while True:
-                    response = conn.readline()
+                    response = read_line(conn, rxbuf) or b''
                     logging.debug(f'Read from device: {response}')
-                    if response.startswith(b'+evn'):
+                    if response.startswith(EVENT_PREFIX):
                         continue
                     if response.startswith(b'+DN:busytag-'):
                         devices.append(port.device)
@@ -66,7 +202,15 @@ class Device(object):
 
     def __init__(self, port_path: Optional[str] = None,
                  connection: Optional[serial.Serial] = None,
-                 baudrate: int = 115200):
+                 baudrate: int = 115200,
+                 cached_info: Optional[DeviceInfo] = None):
+        """Connects to a Busy Tag device.
+
+        :param port_path: Serial port to connect to.
+        :param connection: Already open connection, used if `port_path` is not set.
+        :param baudrate: Baudrate to use when connecting to `port_path`.
+        :param cached_info: Previously retrieved device attributes. If set, they are not queried from the device.
+        """
         assert not (port_path is None and connection is None)
         if port_path is not None:
             self._port = port_path
@@ -76,13 +220,76 @@ class Device(object):
             self._port = None
             self.conn = connection
 
-        self.__capacity = int(self.__get_readonly_attribute('TSS'))
-        self.__device_id = self.__get_readonly_attribute('ID')
-        self.__firmware_version = self.__get_readonly_attribute('FV')
-        self.__hostname = self.__get_readonly_attribute('LHA').removeprefix(
-            'http://')
-        self.__manufacturer = self.__get_readonly_attribute('MN')
-        self.__name = self.__get_readonly_attribute('DN')
+        try:
+            # Only available on Windows.
+            self.conn.set_buffer_size(rx_size=SERIAL_BUFFER_SIZE, tx_size=SERIAL_BUFFER_SIZE)
+        except AttributeError:
+            pass
+
+        # On POSIX systems, read and write the port's file descriptor directly, bypassing pyserial's wrappers.
+        self._fd: Optional[int] = None
+        if sys.platform != 'win32':
+            try:
+                self._fd = self.conn.fileno()
+            except (AttributeError, OSError):
+                pass
+
+        # Bytes read from the device but not yet consumed. Filled by a background thread, so that the device's
+        # responses are drained while we're writing the next command. The thread is stopped by `close()`, or when
+        # the Device is garbage collected.
+        self._rx = ReceiveBuffer()
+        port_name = getattr(self.conn, 'port', None)
+        self._reader = threading.Thread(target=read_loop,
+                                        args=(self.conn, self._fd, self._rx),
+                                        name='busytag-reader' if port_name is None else f'busytag-reader-{port_name}',
+                                        daemon=True)
+        self._reader.start()
+        self._finalizer = weakref.finalize(self, stop_reader, self.conn,
+                                           self._rx, self._reader,
+                                           port_path is not None)
+        # Commands not yet written to the device, and the responses we still have to wait for. Both are only used
+        # while pipelining (see `pipeline()`), and are flushed before reading anything else from the device.
+        self._txbuf = bytearray()
+        self._pending_responses: List[Tuple[str, ...]] = []
+        self._pipelining = False
+
+        if cached_info is None:
+            try:
+                cached_info = self.__query_device_info()
+            except BaseException:
+                self.close()
+                raise
+        self.__set_info(cached_info)
+
+    def __enter__(self) -> 'Device':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Stops reading from the device, and closes the serial port if it was opened by this object.
+
+        Connections passed to the constructor are left open.
+        """
+        self._finalizer()
+
+    @contextlib.contextmanager
+    def pipeline(self) -> Iterator['Device']:
+        """Batches commands that don't return a value.
+
+        Inside the context, commands like `set_display_brightness` or `delete_file` are buffered and sent to the device
+        in a single write, and their responses are checked later. Pending commands are sent, and their responses
+        checked, before any command that reads a value from the device, and when the context exits. Errors from
+        buffered commands are therefore raised at that point rather than by the call that queued them.
+        """
+        assert not self._pipelining
+        self._pipelining = True
+        try:
+            yield self
+        finally:
+            self._pipelining = False
+            self.__flush_pipeline()
 
     def list_pictures(self) -> Sequence[FileEntry]:
         """Lists pictures that can be displayed on the screen."""
@@ -90,16 +297,21 @@ class Device(object):
         result = []
         while True:
             l = self.__readline()
+            if l and l[0] == OK_BYTE and l.startswith(OK_RESPONSE):
+                break
+
             # Unlikely, but event messages might arrive while we're listing
             # files. Silently consume them.
-            if l.startswith(b'+evn'):
+            if l.startswith(EVENT_PREFIX):
                 continue
 
-            if l.startswith(b'OK'):
-                break
-
-            filename, size = l.decode().removeprefix('+PL:').split(',')
-            result.append(FileEntry(filename, int(size)))
+            m = picture_list_re.fullmatch(l)
+            if m is None:
+                raise IOError(f'Malformed picture list entry: {l!r}')
+            try:
+                result.append(FileEntry(m.group(1).decode(), int(m.group(2))))
+            except ValueError as e:
+                raise IOError(f'Malformed picture list entry: {l!r}') from e
 
         return result
 
@@ -109,14 +321,20 @@ class Device(object):
         result = []
         while True:
             l = self.__readline()
-            if l.startswith(b'+evn'):
-                continue
-            if l.startswith(b'OK'):
+            if l and l[0] == OK_BYTE and l.startswith(OK_RESPONSE):
                 break
-            filename, entry_type, size = l.decode().removeprefix('+FL:').split(
-                ',')
-            result.append(
-                FileEntry(filename, int(size), FileEntryType(entry_type)))
+            if l.startswith(EVENT_PREFIX):
+                continue
+
+            m = file_list_re.fullmatch(l)
+            if m is None:
+                raise IOError(f'Malformed file list entry: {l!r}')
+            try:
+                result.append(
+                    FileEntry(m.group(1).decode(), int(m.group(3)),
+                              FileEntryType(m.group(2).decode())))
+            except ValueError as e:
+                raise IOError(f'Malformed file list entry: {l!r}') from e
 
         return result
 
@@ -141,17 +359,22 @@ class Device(object):
         logging.debug(f'Reading {read_size} bytes from device')
         if progress_listener is not None:
             progress_listener.set_max(read_size)
-        response = b''
-        for chunk_size in generate_chunks(read_size):
-            response += self.conn.read(chunk_size)
-            if progress_listener is not None:
-                progress_listener.goto(len(response))
+        # Payload is framed as \r\n<data>\r\nOK\r\n. Wait for all of it to arrive, then copy the data straight out
+        # of the receive buffer.
+        self.__wait_for_bytes(read_size, progress_listener)
+        payload_end = read_size - len(TRANSFER_TERMINATOR)
+        with self._rx.ready:
+            with memoryview(self._rx.data) as view:
+                terminator = bytes(view[payload_end:read_size])
+                payload = bytes(view[2:payload_end])
+            del self._rx.data[:read_size]
 
         if progress_listener is not None:
             progress_listener.finish()
 
-        assert response[-6:] == b'\r\nOK\r\n'
-        return response[2:-6]
+        if terminator != TRANSFER_TERMINATOR:
+            raise IOError(f'Bad terminator: {terminator!r}')
+        return payload
 
     def upload_file(self, filename: str, data: bytes,
                     progress_listener: Optional[
@@ -162,29 +385,64 @@ class Device(object):
         :param data: The contents of the file to upload
         :param progress_listener:
         """
-        logging.info(f'Uploading file {filename} ({len(data)} bytes)')
+        self.upload_file_stream(filename, io.BytesIO(data), len(data),
+                                progress_listener)
+
+    def upload_file_stream(self, filename: str, fp: BinaryIO, size: int,
+                           progress_listener: Optional[
+                               ProgressListener] = None):
+        """Uploads a file to the device, reading its contents from a file object in chunks.
+
+        If `fp` ends before `size` bytes, the transfer is completed with zero padding (so that the device doesn't take
+        the following commands as file contents), the partially uploaded file is deleted, and IOError is raised.
+
+        :param filename: The filename of the file to upload
+        :param fp: Binary file object to read the contents from
+        :param size: Number of bytes to read from `fp` and upload
+        :param progress_listener:
+        """
+        logging.info(f'Uploading file {filename} ({size} bytes)')
 
-        self.__send_command('AT+UF=%s,%d' % (filename, len(data)))
+        self.__send_command('AT+UF=%s,%d' % (filename, size))
         self.__readline()
-        logging.debug('Writing %d bytes to device', len(data))
+        logging.debug('Writing %d bytes to device', size)
         bytes_written = 0
+        bytes_read = 0
+        eof = False
 
         if progress_listener is not None:
-            progress_listener.set_max(len(data))
-
-        for chunk_size in generate_chunks(len(data)):
-            self.conn.write(data[bytes_written:bytes_written + chunk_size])
+            progress_listener.set_max(size)
+
+        for chunk_size in generate_chunks(size):
+            chunk = b''
+            # Unbuffered file objects (e.g. pipes) may return fewer bytes than requested before the end of the file.
+            while not eof and len(chunk) < chunk_size:
+                data = fp.read(chunk_size - len(chunk))
+                if not data:
+                    eof = True
+                    break
+                chunk += data
+            bytes_read += len(chunk)
+            if len(chunk) < chunk_size:
+                chunk += bytes(chunk_size - len(chunk))
+            self.__write(chunk)
             bytes_written += chunk_size
             if progress_listener is not None:
                 progress_listener.goto(bytes_written)
 
         logging.debug('Waiting for device to finish')
-        terminator = self.conn.read(6)
+        terminator = self.__read_exact(len(TRANSFER_TERMINATOR))
 
         if progress_listener is not None:
             progress_listener.finish()
 
-        assert terminator == b'\r\nOK\r\n'
+        if terminator != TRANSFER_TERMINATOR:
+            raise IOError(f'Bad terminator: {terminator!r}')
+
+        if bytes_read < size:
+            logging.error(f'Deleting partially uploaded file {filename}')
+            self.delete_file(filename)
+            raise IOError(f'File {filename} is shorter than {size} bytes (only {bytes_read} bytes read)')
 
     def delete_file(self, filename: str):
         """Deletes a file from the device.'
@@ -193,8 +451,7 @@ class Device(object):
         """
         logging.info(f'Deleting file {filename}')
         self.__send_command('AT+DF=%s' % (filename,))
-        self.__read_response('+DF:')
-        self.__read_response('OK')
+        self.__expect_response('+DF:', 'OK')
 
     def set_active_picture(self, filename: str):
         """Set the picture that will be shown on the display."""
@@ -228,7 +485,7 @@ class Device(object):
         self.__send_command('AT+CP?')
         while True:
             entry = self.__readline().strip()
-            if entry.startswith(b'ERROR'):
+            if entry.startswith(ERROR_PREFIX):
                 logging.error('Received error response: %s', entry)
                 raise self.build_exception(entry)
             if entry.startswith(b'+CP'):
@@ -237,7 +494,7 @@ class Device(object):
                 result.append(
                     LedPatternEntry(LedPin(int(pins)), rgb, int(speed),
                                     int(delay)))
-            elif entry.startswith(b'OK'):
+            elif entry.startswith(OK_RESPONSE):
                 break
 
         return result
@@ -248,7 +505,7 @@ class Device(object):
         self.__read_response('>')
         for entry in pattern:
             self.__send_command(f'+CP:{entry}')
-        self.__read_response('OK')
+        self.__expect_response('OK')
 
     def get_wifi_config(self) -> WifiConfig:
         response = self.__get_attribute('WC')
@@ -264,7 +521,19 @@ class Device(object):
     def reset_wifi_config(self):
         logging.info('Resetting wifi configuration')
         self.__send_command('AT+FRWCF')
-        self.__read_response('OK')
+        self.__expect_response('OK')
+
+    def refresh_info(self):
+        """Queries the read-only device attributes again, e.g. if the Device was created with `cached_info`."""
+        self.__set_info(self.__query_device_info())
+
+    @property
+    def info(self) -> DeviceInfo:
+        """Read-only device attributes, e.g. to pass as `cached_info` on later connections."""
+        return DeviceInfo(name=self.__name, device_id=self.__device_id,
+                          firmware_version=self.__firmware_version,
+                          manufacturer=self.__manufacturer,
+                          hostname=self.__hostname, capacity=self.__capacity)
 
     @property
     def capacity(self) -> int:
@@ -290,6 +559,25 @@ class Device(object):
     def name(self) -> str:
         return self.__name
 
+    def __set_info(self, info: DeviceInfo):
+        self.__capacity = info.capacity
+        self.__device_id = info.device_id
+        self.__firmware_version = info.firmware_version
+        self.__hostname = info.hostname
+        self.__manufacturer = info.manufacturer
+        self.__name = info.name
+
+    def __query_device_info(self) -> DeviceInfo:
+        # The device processes commands in order, so send all the queries at once rather than waiting for each
+        # response before sending the next command.
+        capacity, device_id, firmware_version, hostname, manufacturer, name = self.__get_readonly_attributes(
+            'TSS', 'ID', 'FV', 'LHA', 'MN', 'DN')
+        return DeviceInfo(name=name, device_id=device_id,
+                          firmware_version=firmware_version,
+                          manufacturer=manufacturer,
+                          hostname=hostname.removeprefix('http://'),
+                          capacity=int(capacity))
+
     def __get_readonly_attribute(self, attribute: str) -> str:
         """Retrieves the value of a read-only attribute (e.g. device id)."""
         response_prefix = f'+{attribute}:'
@@ -297,6 +585,12 @@ class Device(object):
         return self.__read_response(response_prefix).decode().removeprefix(
             response_prefix)
 
+    def __get_readonly_attributes(self, *attributes: str) -> List[str]:
+        """Retrieves the values of several read-only attributes using a single write."""
+        responses = self.__exec_pipelined([(f'AT+G{attribute}', f'+{attribute}:') for attribute in attributes])
+        return [response.decode().removeprefix(f'+{attribute}:') for attribute, response in
+                zip(attributes, responses)]
+
     def __get_attribute(self, attribute: str) -> str:
         """Retrieves the value of a user-modifiable attribute (e.g. active picture)."""
         response_prefix = f'+{attribute}:'
@@ -307,12 +601,63 @@ class Device(object):
     def __set_attribute(self, attribute: str, value: str):
         """Sets the value of a user-modifiable attribute (e.g. active picture)."""
         self.__send_command(f'AT+{attribute}={value}')
-        self.__read_response('OK')
+        self.__expect_response('OK')
 
     def __send_command(self, command: str):
         encoded_command = command.encode() + b'\r\n'
+        if self._pipelining:
+            logging.debug('Queueing command: %s', encoded_command)
+            self._txbuf += encoded_command
+            return
         logging.debug('Sending command: %s', encoded_command)
-        self.conn.write(encoded_command)
+        self.__write(encoded_command)
+
+    def __exec_pipelined(self, commands: Sequence[Tuple[str, str]]) -> List[bytes]:
+        """Sends several commands in one write, then reads their responses in order.
+
+        :param commands: Pairs of (command, expected response prefix).
+        :return: The response to each command.
+        """
+        for command, _ in commands:
+            self._txbuf += command.encode() + b'\r\n'
+        return [self.__read_response(prefix) for _, prefix in commands]
+
+    def __expect_response(self, *prefixes: str):
+        """Waits for the response lines to a command whose contents we don't need, deferring it while pipelining.
+
+        :param prefixes: Expected prefix of each line of the response, in order.
+        """
+        if self._pipelining:
+            self._pending_responses.append(prefixes)
+        else:
+            for prefix in prefixes:
+                self.__read_response(prefix)
+
+    def __flush_pipeline(self):
+        """Sends queued commands and waits for their pending responses.
+
+        If commands failed, the responses to the rest of the batch are still read (so that they're not mistaken for
+        the responses to later commands), then the first error is raised.
+        """
+        if self._txbuf:
+            logging.debug('Sending commands: %s', self._txbuf)
+            self.__write(self._txbuf)
+            self._txbuf = bytearray()
+        pending, self._pending_responses = self._pending_responses, []
+        first_error: Optional[Exception] = None
+        for prefixes in pending:
+            try:
+                for prefix in prefixes:
+                    self.__read_response(prefix)
+            except (ConnectionError, TimeoutError):
+                # Nothing more is coming from the device.
+                raise
+            except Exception as e:
+                # The device answers a failed command with a single ERROR line, so move on to the next command.
+                if first_error is None:
+                    first_error = e
+        if first_error is not None:
+            raise first_error
 
     def __read_response(self, prefix: str) -> bytes:
         logging.debug(f'Waiting for prefix: {prefix}')
@@ -323,39 +668,81 @@ class Device(object):
                 return response
 
     def __readline(self) -> bytes:
-        result = self.conn.readline()
+        if self._txbuf or self._pending_responses:
+            self.__flush_pipeline()
+        with self._rx.ready:
+            while (result := pop_line(self._rx.data)) is None:
+                self.__wait_for_data()
         logging.debug('Read from device: %s', result)
-        if result.startswith(b'ERROR'):
+        if result and result[0] == ERROR_BYTE and result.startswith(ERROR_PREFIX):
             logging.error('Received error response: %s', result)
             raise self.build_exception(result)
         return result.strip()
 
+    def __write(self, data: bytes):
+        if self._rx.stopping:
+            raise ConnectionError('Device is closed')
+        if self._fd is None:
+            self.conn.write(data)
+            return
+
+        # pyserial opens the port in non-blocking mode, so handle partial writes and wait for the port to become
+        # writable when its buffer is full, for at most the connection's write timeout (as pyserial would).
+        write_timeout = self.conn.write_timeout
+        deadline = None if write_timeout is None else time.monotonic() + write_timeout
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                _, writable, _ = select.select([], [self._fd], [], remaining)
+                if not writable:
+                    raise serial.SerialTimeoutException('Write timeout')
+                continue
+            view = view[written:]
+
+    def __read_exact(self, size: int) -> bytes:
+        """Reads exactly `size` bytes from the device."""
+        with self._rx.ready:
+            while len(self._rx.data) < size:
+                self.__wait_for_data()
+            result = bytes(self._rx.data[:size])
+            del self._rx.data[:size]
+        return result
+
+    def __wait_for_bytes(self, size: int, progress_listener: Optional[ProgressListener] = None):
+        """Waits until at least `size` bytes have been received, reporting progress as data arrives."""
+        received = None
+        while True:
+            with self._rx.ready:
+                if received is not None and len(self._rx.data) < size:
+                    self.__wait_for_data()
+                received = min(len(self._rx.data), size)
+            if progress_listener is not None:
+                progress_listener.goto(received)
+            if received == size:
+                return
+
+    def __wait_for_data(self):
+        """Waits for the reader thread to receive more data. Must be called holding `_rx.ready`.
+
+        Waits for at most the connection's timeout, if it has one.
+        """
+        if self._rx.error is not None:
+            raise ConnectionError('Connection to device lost') from self._rx.error
+        if self._rx.stopping:
+            raise ConnectionError('Device is closed')
+        if not self._rx.ready.wait(self.conn.timeout):
+            raise TimeoutError('Timed out waiting for a response from the device')
+
     @staticmethod
     def build_exception(error_response: bytes) -> Exception:
         """Converts an error response from Busy Tag to an Exception"""
-        if not error_response.startswith(b'ERROR:'):
+        prefix, separator, code = error_response.strip().partition(b':')
+        error = ERROR_CODES.get(code) if prefix == ERROR_PREFIX and separator else None
+        if error is None:
             return Exception(
                 'Unexpected error response %s' % (error_response.decode(),))
-
-        parts = error_response.decode().strip().split(':')
-        if len(parts) != 2:
-            return Exception(
-                'Unexpected error response %s' % (error_response.decode(),))
-
-        match parts[1]:
-            case '-1':
-                return Exception(
-                    'Unexpected error response %s' % (error_response.decode(),))
-            case '0':
-                return Exception('Unknown error')
-            case '1':
-                return ValueError('Invalid command')
-            case '2':
-                return ValueError('Invalid argument')
-            case '3':
-                return FileNotFoundError('File not found')
-            case '4':
-                return ValueError('Invalid size')
-            case _:
-                return Exception(
-                    'Unexpected error response %s' % (error_response.decode(),))
+        exception_class, message = error
+        return exception_class(message)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # SPDX-License-Identifier: MIT
-from os.path import basename, expanduser
+import contextlib
+from os.path import basename, expanduser, getsize
 from typing import List, Optional
 
 from absl import app, flags
@@ -31,12 +32,13 @@ class ProgressBar(Bar, ProgressListener):
         self.start()
 
 
+# (format, divisor) for sizes under 1 kB, under 500 kB, and larger.
+SIZE_FORMATS = (('%d B', 1), ('%.2f kB', 1_000), ('%.2f MB', 1_000_000))
+
+
 def format_size(size: int) -> str:
-    if size < 1_000:
-        return f'{size} B'
-    if size < 500_000:
-        return f'{size / 1_000:.2f} kB'
-    return f'{size / 1_000_000:.2f} MB'
+    fmt, divisor = SIZE_FORMATS[(size >= 1_000) + (size >= 500_000)]
+    return fmt % (size / divisor)
 
 
 def main(argv: List[str]) -> Optional[int]:
@@ -45,23 +47,54 @@ def main(argv: List[str]) -> Optional[int]:
         config.device = FLAGS.device
     config.write_to_file()
     bt: Optional[Device] = None
+    # Whether bt's attributes were queried from the device during this run, rather than read from the cache.
+    info_is_fresh = False
 
     # Remove argv[0]
     exec_name = argv.pop(0)
-    command = 'help'
-    if len(argv) > 0:
-        command = argv.pop(0)
+    if len(argv) == 0:
+        argv.append('help')
+
+    with contextlib.ExitStack() as stack:
+        while len(argv) > 0:
+            command = argv.pop(0)
+
+            # Don't bother connecting for commands that don't need a device connection.
+            if bt is None and command not in ('list_devices', 'help'):
+                if config.device is None:
+                    print(
+                        'A device must be specified using the `--device` flag or be set in the config file!')
+                    print(
+                        f'You can run `{exec_name} list_devices` to find the available devices.')
+                    return 1
+                # Reuse the device attributes from previous runs to skip querying them, except for `info`, which
+                # refreshes the cache.
+                cached_info = None if command == 'info' else config.device_cache.get(config.device)
+                bt = Device(config.device, baudrate=FLAGS.baudrate, cached_info=cached_info)
+                stack.enter_context(bt)
+                info_is_fresh = cached_info is None
+                # Send consecutive commands that don't print anything in a single batch; commands that read from
+                # the device wait for the batch to complete first. Errors from batched commands are only raised
+                # then, so later commands in the batch still run after one fails.
+                stack.enter_context(bt.pipeline())
+
+            if command == 'info' and not info_is_fresh:
+                bt.refresh_info()
+                info_is_fresh = True
+            if bt is not None and config.device_cache.get(config.device) != bt.info:
+                config.device_cache[config.device] = bt.info
+                config.write_to_file()
+
+            result = run_command(exec_name, command, argv, config, bt)
+            if result:
+                return result
+
+    return 0
 
-        # Don't bother connecting for commands that don't need a device connection.
-        if command not in ('list_devices', 'help'):
-            if config.device is None:
-                print(
-                    'A device must be specified using the `--device` flag or be set in the config file!')
-                print(
-                    f'You can run `{exec_name} list_devices` to find the available devices.')
-                return 1
-            bt = Device(config.device, baudrate=FLAGS.baudrate)
 
+def run_command(exec_name: str, command: str, argv: List[str],
+                config: ToolConfig, bt: Optional[Device]) -> Optional[int]:
+    """Runs a single CLI command, consuming its arguments from `argv`."""
     match command:
         case 'info':
             print(f'Device name:      {bt.name}')
@@ -104,8 +137,8 @@ def main(argv: List[str]) -> Optional[int]:
             assert len(argv) >= 1
             filename = expanduser(argv.pop(0))
             with open(filename, 'rb') as fp:
-                bt.upload_file(basename(filename), fp.read(),
-                               ProgressBar(f'Uploading {basename(filename)}'))
+                bt.upload_file_stream(basename(filename), fp, getsize(filename),
+                                      ProgressBar(f'Uploading {basename(filename)}'))
 
         case 'get':
             assert len(argv) >= 1
@@ -143,7 +176,7 @@ def main(argv: List[str]) -> Optional[int]:
             bt.set_display_brightness(brightness)
 
         case 'help':
-            print(f'\n\tUSAGE: {exec_name} [flags] <command> [<args>]\n')
+            print(f'\n\tUSAGE: {exec_name} [flags] <command> [<args>] [<command> [<args>] ...]\n')
             print('Available commands:')
             print('  help: Prints this message')
             print('  list_devices: Lists available devices')
@@ -171,7 +204,7 @@ def main(argv: List[str]) -> Optional[int]:
                 f'Unknown command `{command}`. Please use the `help` to list available commands')
             return 1
 
-    return 0
+    return None
 
 
 def run_main():
@@ -8,7 +8,7 @@ from enum import Enum, IntFlag, verify, NAMED_FLAGS
 rgb_re = re.compile(r'^[0-9A-F]{6}$')
 
 __all__ = ['LedPin', 'FileEntry', 'FileEntryType', 'WifiConfig', 'LedConfig',
-           'LedPatternEntry', 'ProgressListener']
+           'LedPatternEntry', 'ProgressListener', 'DeviceInfo']
 
 
 @verify(NAMED_FLAGS)
@@ -28,7 +28,7 @@ class FileEntryType(Enum):
     DIRECTORY = 'dir'
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class FileEntry:
     """File stored in the Busy Tag device."""
     name: str
@@ -36,13 +36,24 @@ class FileEntry:
     type: FileEntryType = FileEntryType.FILE
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class WifiConfig:
     """Wifi configuration."""
     ssid: str
     password: str
 
 
+@dataclass(frozen=True)
+class DeviceInfo:
+    """Read-only device attributes, queried when connecting to the device."""
+    name: str
+    device_id: str
+    firmware_version: str
+    manufacturer: str
+    hostname: str
+    capacity: int
+
+
 @dataclass(frozen=True)
 class LedConfig:
     pins: LedPin
@@ -3,7 +3,7 @@ import os
 import pytest
 import tomlkit
 from busytag.config import ToolConfig
-from busytag.types import LedConfig, LedPin
+from busytag.types import DeviceInfo, LedConfig, LedPin
 
 
 @pytest.fixture
@@ -47,3 +47,26 @@ def test_writes_config(tmp_path):
 
     c = tomlkit.loads(p.read_text())
     assert c['device'] == '/dev/tty.somedevice'
+
+
+def test_loads_config_with_device_cache(testdata_path):
+    config = ToolConfig(testdata_path('config-with-device-cache'))
+    assert config.device_cache == {
+        '/dev/tty.usbmodem': DeviceInfo(name='busytag-ABCDEF',
+                                        device_id='ABCDEF',
+                                        firmware_version='2.0',
+                                        manufacturer='Luxafor',
+                                        hostname='busytag-abcdef.local',
+                                        capacity=1_000_000)}
+
+
+def test_writes_device_cache(tmp_path):
+    p = tmp_path / 'config_with_device_cache.toml'
+    config = ToolConfig(str(p))
+    info = DeviceInfo(name='busytag-ABCDEF', device_id='ABCDEF',
+                      firmware_version='2.0', manufacturer='Luxafor',
+                      hostname='busytag-abcdef.local', capacity=1_000_000)
+    config.device_cache['/dev/tty.somedevice'] = info
+    config.write_to_file()
+
+    assert ToolConfig(str(p)).device_cache == {'/dev/tty.somedevice': info}
@@ -0,0 +1,473 @@
+import gc
+import io
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+from typing import Optional, Tuple
+
+import pytest
+import serial
+import busytag.device
+from busytag.device import Device, TRANSFER_CHUNK_SIZE, generate_chunks
+from busytag.types import DeviceInfo, FileEntry, FileEntryType, ProgressListener
+
+DEVICE_INFO = DeviceInfo(name='busytag-ABCDEF', device_id='ABCDEF',
+                         firmware_version='2.0', manufacturer='Luxafor',
+                         hostname='busytag-abcdef.local', capacity=1_000_000)
+
+INFO_RESPONSES = {
+    b'AT+GTSS': b'+TSS:1000000\r\n',
+    b'AT+GID': b'+ID:ABCDEF\r\n',
+    b'AT+GFV': b'+FV:2.0\r\n',
+    b'AT+GLHA': b'+LHA:http://busytag-abcdef.local\r\n',
+    b'AT+GMN': b'+MN:Luxafor\r\n',
+    b'AT+GDN': b'+DN:busytag-ABCDEF\r\n',
+}
+
+
+class FakeConnection(object):
+    """Stand-in for serial.Serial that answers each command from a dict (or with OK)."""
+
+    def __init__(self, responses=None, timeout=None):
+        self.responses = dict(INFO_RESPONSES)
+        self.responses.update(responses or {})
+        self.timeout = timeout
+        self.commands = []
+        self.writes = 0
+        # Files uploaded with AT+UF, and the terminator sent after each upload.
+        self.files = {}
+        self.upload_terminator = b'\r\nOK\r\n'
+        self.__upload: Optional[Tuple[str, int]] = None
+        self.__rx = bytearray()
+        self.__tx = bytearray()
+        self.__cancelled = False
+        self.__cv = threading.Condition()
+
+    @property
+    def in_waiting(self) -> int:
+        with self.__cv:
+            return len(self.__rx)
+
+    def read(self, size: int) -> bytes:
+        with self.__cv:
+            self.__cv.wait_for(lambda: self.__rx or self.__cancelled,
+                               self.timeout)
+            self.__cancelled = False
+            result = bytes(self.__rx[:size])
+            del self.__rx[:size]
+            return result
+
+    def write(self, data: bytes) -> int:
+        with self.__cv:
+            self.writes += 1
+            self.__tx += data
+            while True:
+                if self.__upload is not None:
+                    filename, size = self.__upload
+                    if len(self.__tx) < size:
+                        break
+                    self.files[filename] = bytes(self.__tx[:size])
+                    del self.__tx[:size]
+                    self.__upload = None
+                    self.__rx += self.upload_terminator
+                    continue
+                if b'\r\n' not in self.__tx:
+                    break
+                command, _, rest = bytes(self.__tx).partition(b'\r\n')
+                self.__tx = bytearray(rest)
+                self.commands.append(command)
+                if command.startswith(b'AT+UF='):
+                    filename, _, size = command.removeprefix(b'AT+UF=').rpartition(b',')
+                    self.__upload = (filename.decode(), int(size))
+                    self.__rx += b'>\r\n'
+                else:
+                    self.__rx += self.responses.get(command, b'OK\r\n')
+            self.__cv.notify_all()
+        return len(data)
+
+    def cancel_read(self):
+        with self.__cv:
+            self.__cancelled = True
+            self.__cv.notify_all()
+
+
+@pytest.fixture
+def conn():
+    return FakeConnection()
+
+
+@pytest.fixture
+def device(conn):
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        yield bt
+
+
+def test_close_stops_reader_thread(conn):
+    bt = Device(connection=conn, cached_info=DEVICE_INFO)
+    bt.close()
+
+    assert not bt._reader.is_alive()
+    with pytest.raises(ConnectionError):
+        bt.get_display_brightness()
+
+
+def test_garbage_collection_stops_reader_thread(conn):
+    reader = Device(connection=conn, cached_info=DEVICE_INFO)._reader
+    gc.collect()
+
+    reader.join(timeout=1)
+    assert not reader.is_alive()
+
+
+def test_raises_timeout_error_when_device_does_not_answer():
+    conn = FakeConnection({b'AT+GTSS': b''}, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        Device(connection=conn)
+
+
+def test_list_files():
+    conn = FakeConnection({b'AT+GFL': b'+FL:a.png,file,10\r\n'
+                                     b'+evn:SP,a.png\r\n'
+                                     b'+FL:b,c.png,file,20\r\n'
+                                     b'+FL:pics,dir,0\r\n'
+                                     b'OK\r\n'})
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        assert bt.list_files() == [
+            FileEntry('a.png', 10),
+            FileEntry('b,c.png', 20),
+            FileEntry('pics', 0, FileEntryType.DIRECTORY)]
+
+
+def test_list_pictures():
+    conn = FakeConnection({b'AT+GPL': b'+PL:a.png,10\r\n'
+                                     b'+PL:b,c.png,20\r\n'
+                                     b'OK\r\n'})
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        assert bt.list_pictures() == [FileEntry('a.png', 10),
+                                      FileEntry('b,c.png', 20)]
+
+
+@pytest.mark.parametrize('line', [b'+FL:a.png,10', b'+FL:a.png,file,big',
+                                  b'+FL:a.png,link,10', b'+FL:,file,10',
+                                  b'+XX:a.png'])
+def test_list_files_raises_on_malformed_entry(line):
+    conn = FakeConnection({b'AT+GFL': line + b'\r\nOK\r\n'})
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        with pytest.raises(IOError):
+            bt.list_files()
+
+
+def test_pipeline_sends_queued_commands_in_one_write(device, conn):
+    conn.responses[b'AT+DF=b.png'] = b'+DF:b.png\r\nOK\r\n'
+    writes = conn.writes
+    with device.pipeline():
+        device.set_display_brightness(40)
+        device.set_active_picture('a.png')
+        device.delete_file('b.png')
+        assert conn.writes == writes
+
+    assert conn.writes == writes + 1
+    assert conn.commands == [b'AT+DB=40', b'AT+SP=a.png', b'AT+DF=b.png']
+
+
+def test_pipeline_flushes_before_queries(conn):
+    conn.responses[b'AT+DB?'] = b'+DB:40\r\n'
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        with bt.pipeline():
+            bt.set_display_brightness(40)
+            assert bt.get_display_brightness() == 40
+            bt.set_active_picture('a.png')
+
+    assert conn.commands == [b'AT+DB=40', b'AT+DB?', b'AT+SP=a.png']
+
+
+def test_pipeline_raises_first_error_and_stays_in_sync(conn):
+    conn.responses[b'AT+DF=missing.png'] = b'ERROR:3\r\n'
+    conn.responses[b'AT+SP=missing.png'] = b'ERROR:2\r\n'
+    conn.responses[b'AT+DB?'] = b'+DB:40\r\n'
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        with pytest.raises(FileNotFoundError):
+            with bt.pipeline():
+                bt.delete_file('missing.png')
+                bt.set_active_picture('missing.png')
+                bt.set_display_brightness(40)
+
+        # Responses to the whole batch were consumed.
+        assert bt.get_display_brightness() == 40
+        bt.set_active_picture('a.png')
+
+
+def test_cached_info_skips_queries(conn):
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        assert bt.info == DEVICE_INFO
+    assert conn.commands == []
+
+
+def test_refresh_info_queries_device(conn):
+    cached = DeviceInfo(name='busytag-OLD', device_id='ABCDEF',
+                        firmware_version='1.0', manufacturer='Luxafor',
+                        hostname='busytag-abcdef.local', capacity=1_000_000)
+    with Device(connection=conn, cached_info=cached) as bt:
+        bt.refresh_info()
+        assert bt.info == DEVICE_INFO
+
+
+class TrickleReader(io.RawIOBase):
+    """Unbuffered file object that returns at most 7 bytes per read, like a pipe might."""
+
+    def __init__(self, data: bytes):
+        self.__data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.__data.read(min(len(buffer), 7))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def test_upload_file(device, conn):
+    data = bytes(range(256)) * 40
+    device.upload_file('a.bin', data)
+    assert conn.files == {'a.bin': data}
+
+
+def test_upload_file_stream_handles_short_reads(device, conn):
+    data = bytes(range(256)) * 40
+    device.upload_file_stream('a.bin', TrickleReader(data), len(data))
+    assert conn.files == {'a.bin': data}
+
+
+def test_upload_file_stream_pads_and_deletes_truncated_file(device, conn):
+    conn.responses[b'AT+DF=a.bin'] = b'+DF:a.bin\r\nOK\r\n'
+    conn.responses[b'AT+DB?'] = b'+DB:40\r\n'
+    with pytest.raises(IOError, match='shorter'):
+        device.upload_file_stream('a.bin', io.BytesIO(b'abc'), 10)
+
+    # The transfer was completed, so the device is still in sync.
+    assert conn.files == {'a.bin': b'abc' + bytes(7)}
+    assert conn.commands[-1] == b'AT+DF=a.bin'
+    assert device.get_display_brightness() == 40
+
+
+class PtyDevice(object):
+    """Fake device on the master side of a pseudo-terminal, so that Device talks to a real serial port fd.
+
+    Reads at most `read_size` bytes at a time, pausing `read_delay` seconds between reads, so that the port's buffer
+    fills up during large writes.
+    """
+
+    def __init__(self, read_size: int = 4096, read_delay: float = 0.0):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.files = {}
+        self.reading = True
+        self.__read_size = read_size
+        self.__read_delay = read_delay
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __run(self):
+        buffer = b''
+        upload = None
+        while True:
+            if not self.reading:
+                time.sleep(0.01)
+                continue
+            try:
+                buffer += os.read(self.master, self.__read_size)
+            except OSError:
+                return
+            time.sleep(self.__read_delay)
+            while True:
+                if upload is not None:
+                    filename, size = upload
+                    if len(buffer) < size:
+                        break
+                    self.files[filename], buffer = buffer[:size], buffer[size:]
+                    upload = None
+                    os.write(self.master, b'\r\nOK\r\n')
+                    continue
+                if b'\r\n' not in buffer:
+                    break
+                command, buffer = buffer.split(b'\r\n', 1)
+                if command.startswith(b'AT+UF='):
+                    filename, _, size = command.removeprefix(b'AT+UF=').rpartition(b',')
+                    upload = (filename.decode(), int(size))
+                    os.write(self.master, b'>\r\n')
+                    # Stop reading after acknowledging a 'stalled.bin' upload, to simulate a stuck device.
+                    self.reading = filename != b'stalled.bin'
+                else:
+                    os.write(self.master, INFO_RESPONSES.get(command, b'OK\r\n'))
+
+
+@pytest.fixture
+def pty_device():
+    if sys.platform == 'win32':
+        pytest.skip('pseudo-terminals are POSIX-only')
+    device = PtyDevice(read_size=512, read_delay=0.001)
+    yield device
+    device.close()
+
+
+def test_uses_file_descriptor_over_pty(pty_device, monkeypatch):
+    writes = []
+    os_write = os.write
+
+    def recording_write(fd, data):
+        written = os_write(fd, data)
+        writes.append((len(data), written))
+        return written
+
+    monkeypatch.setattr(busytag.device.os, 'write', recording_write)
+    data = bytes(range(256)) * 1024
+    with Device(pty_device.port) as bt:
+        assert bt._fd is not None
+        assert bt.info == DEVICE_INFO
+        bt.upload_file('a.bin', data)
+
+    assert pty_device.files == {'a.bin': data}
+    # The port's buffer filled up, so some writes were partial.
+    assert any(written < size for size, written in writes)
+
+
+def test_write_timeout_over_pty(pty_device):
+    conn = serial.Serial(pty_device.port, write_timeout=0.2)
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        with pytest.raises(serial.SerialTimeoutException):
+            bt.upload_file('stalled.bin', bytes(1 << 20))
+    conn.close()
+
+
+class RecordingProgressListener(ProgressListener):
+    def __init__(self):
+        self.max = None
+        self.positions = []
+        self.finished = False
+
+    def set_max(self, max: int) -> None:
+        self.max = max
+
+    def goto(self, position: int):
+        self.positions.append(position)
+
+    def finish(self):
+        self.finished = True
+
+
+def read_file_response(filename: str, data: bytes) -> bytes:
+    return b'+GF:%s,%d\r\n\r\n%s\r\nOK\r\n' % (filename.encode(), len(data), data)
+
+
+def test_read_file_reports_progress(conn):
+    data = b'hello\r\nworld'
+    conn.responses[b'AT+GF=a.txt'] = read_file_response('a.txt', data)
+    listener = RecordingProgressListener()
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        assert bt.read_file('a.txt', listener) == data
+
+    assert listener.max == len(data) + 8
+    assert listener.positions[-1] == len(data) + 8
+    assert listener.finished
+
+
+@pytest.mark.parametrize('n, chunk_size, expected', [
+    (0, 1000, []),
+    (10, 1000, [10]),
+    (1000, 1000, [1000]),
+    (2000, 1000, [1000, 1000]),
+    (2500, 1000, [1000, 1000, 500]),
+])
+def test_generate_chunks(n, chunk_size, expected):
+    assert list(generate_chunks(n, chunk_size)) == expected
+
+
+def test_generate_chunks_covers_exact_multiple_of_chunk_size():
+    assert sum(generate_chunks(2 * TRANSFER_CHUNK_SIZE)) == 2 * TRANSFER_CHUNK_SIZE
+
+
+@pytest.mark.parametrize('size', [0, TRANSFER_CHUNK_SIZE, 2 * TRANSFER_CHUNK_SIZE, 2 * TRANSFER_CHUNK_SIZE + 1])
+def test_read_file_and_upload_file_round_trip(conn, size):
+    data = bytes(i % 251 for i in range(size))
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        bt.upload_file('a.bin', data)
+        conn.responses[b'AT+GF=a.bin'] = read_file_response('a.bin', conn.files['a.bin'])
+        assert bt.read_file('a.bin') == data
+
+
+def test_read_file_raises_on_bad_terminator(conn):
+    conn.responses[b'AT+GF=a.txt'] = b'+GF:a.txt,5\r\n\r\nhello\r\nXX\r\n'
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        with pytest.raises(IOError, match='Bad terminator'):
+            bt.read_file('a.txt')
+
+
+def test_upload_file_raises_on_bad_terminator(conn):
+    conn.upload_terminator = b'\r\nXX\r\n'
+    with Device(connection=conn, cached_info=DEVICE_INFO) as bt:
+        with pytest.raises(IOError, match='Bad terminator'):
+            bt.upload_file('a.txt', b'hello')
+
+
+@pytest.mark.parametrize('response, exception_class, message', [
+    (b'ERROR:0', Exception, 'Unknown error'),
+    (b'ERROR:1', ValueError, 'Invalid command'),
+    (b'ERROR:2', ValueError, 'Invalid argument'),
+    (b'ERROR:3', FileNotFoundError, 'File not found'),
+    (b'ERROR:4', ValueError, 'Invalid size'),
+    (b'ERROR:3\r\n', FileNotFoundError, 'File not found'),
+    (b'ERROR:-1', Exception, 'Unexpected error response ERROR:-1'),
+    (b'ERROR:5', Exception, 'Unexpected error response ERROR:5'),
+    (b'ERROR:1:2', Exception, 'Unexpected error response ERROR:1:2'),
+    (b'ERROR', Exception, 'Unexpected error response ERROR'),
+    (b'OK', Exception, 'Unexpected error response OK'),
+])
+def test_build_exception(response, exception_class, message):
+    e = Device.build_exception(response)
+    assert type(e) is exception_class
+    assert str(e) == message
+
+
+def test_queries_device_info_in_one_write(conn):
+    with Device(connection=conn) as bt:
+        assert bt.info == DEVICE_INFO
+
+    assert conn.writes == 1
+    assert conn.commands == [b'AT+GTSS', b'AT+GID', b'AT+GFV', b'AT+GLHA',
+                             b'AT+GMN', b'AT+GDN']
+
+
+class UncancellableConnection(FakeConnection):
+    """Connection whose cancel_read() misses reads that haven't started yet, like pyserial's on Windows."""
+
+    def cancel_read(self):
+        pass
+
+
+def test_close_does_not_hang_if_read_cannot_be_cancelled():
+    conn = UncancellableConnection()
+    bt = Device(connection=conn, cached_info=DEVICE_INFO)
+    assert bt._reader.name == 'busytag-reader'
+
+    start = time.monotonic()
+    bt.close()
+    assert time.monotonic() - start < 5
+    assert bt._reader.is_alive()
+
+    # The thread exits once its blocked read returns.
+    conn.write(b'AT+DB?\r\n')
+    bt._reader.join(timeout=1)
+    assert not bt._reader.is_alive()
+
+
+def test_reader_thread_is_named_after_port(pty_device):
+    with Device(pty_device.port) as bt:
+        assert bt._reader.name == f'busytag-reader-{pty_device.port}'
@@ -0,0 +1,15 @@
+import pytest
+from busytag.tool import format_size
+
+
+@pytest.mark.parametrize('size, expected', [
+    (0, '0 B'),
+    (999, '999 B'),
+    (1_000, '1.00 kB'),
+    (1_234, '1.23 kB'),
+    (499_999, '500.00 kB'),
+    (500_000, '0.50 MB'),
+    (12_345_678, '12.35 MB'),
+])
+def test_format_size(size, expected):
+    assert format_size(size) == expected